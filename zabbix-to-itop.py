@@ -4,16 +4,27 @@
 from __future__ import annotations
 
 import argparse
+import contextlib
 import csv
+import functools
 import os
-from typing import Dict, List, Tuple, Any
+import subprocess
+import types
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Deque, Dict, FrozenSet, Iterable, Iterator, List, Set, Tuple, Any
 import logging
 
 import jinja2
 import tqdm
 import yaml
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader  # type: ignore
 from zabbix_utils import ZabbixAPI  # type: ignore
-from zabbixhost import ZabbixHost
+from zabbixhost import ZabbixHost, compile_filters, compile_template
+from zabbixrpc import ZabbixRPC
 
 def get_output_columns(cfg):
     columns = []
@@ -26,11 +37,22 @@ def get_output_columns(cfg):
             columns.append(c.get("template")["itop"])
     if len(list(set(columns))) != len(columns):
         raise Exception("Destination itop attributes are not unique!")
+    for u in cfg.get("unique") or []:
+        if u not in columns:
+            raise Exception("Unique column %s (in 'unique' of output with outfile %s) is not a destination itop attribute!" % (u, cfg.get("outfile")))
     return columns
 
-def build_row_for_host(h: ZabbixHost, cfg) -> Dict[str, str]:
+# map path prefixes handled by public ZabbixHost accessors, resolved once per column
+MAP_HANDLERS: Dict[str, Callable[..., str]] = {
+    name: fn for (name, fn) in vars(ZabbixHost).items()
+    if not name.startswith("_") and isinstance(fn, types.FunctionType)
+}
+
+
+def compile_columns(cfg) -> List[Tuple[str, Callable[[ZabbixHost], str]]]:
     """
-    Build output row for this host based on structured YAML column list.
+    Compile structured YAML column list into (itop attribute, getter) plan.
+    This is done once per output, so per-host work is just calling getters.
     columns is a list of dict entries, each in one of forms:
 
       - static:
@@ -45,55 +67,53 @@ def build_row_for_host(h: ZabbixHost, cfg) -> Dict[str, str]:
           zabbix: "inventory.os"
           itop: "OS family->Name"
     """
-    row: Dict[str, str] = {}
+    plan: List[Tuple[str, Callable[[ZabbixHost], str]]] = []
 
     for entry in cfg["columns"]:
         if "static" in entry:
             spec = entry["static"]
-            itop_attr = spec["itop"]
             value = spec.get("value", "") or ""
-            row[itop_attr] = value
+            fn = lambda h, v=value: v
 
         elif "template" in entry:
             spec = entry["template"]
-            itop_attr = spec["itop"]
-            tmpl = spec.get("value","") or ""
-            row[itop_attr] = h._expand_macros(tmpl)
+            tpl = compile_template(spec.get("value", "") or "")
+            fn = lambda h, t=tpl: t.render(zbx=h)
 
         elif "map" in entry:
             spec = entry["map"]
-            itop_attr = spec["itop"]
             zpath = spec["zabbix"]
+            prefix, _, key = zpath.partition(".")
+            handler = MAP_HANDLERS.get(prefix)
+            if handler is None:
+                raise Exception("Item zbx.%s not found! Available map items: %s" % (zpath, ", ".join(sorted(MAP_HANDLERS))))
             if "." in zpath:
-                prefix, key = zpath.split(".", 1)
-                # fallback for future prefixes / direct macro
-                fn = getattr(h, prefix, None)
-                args = key
-                if callable(fn):
-                    row[itop_attr] = fn(args)
-                else:
-                    row[itop_attr] = ""
+                # accessor with argument like "inventory.os" → h.inventory("os")
+                fn = lambda h, m=handler, k=key: m(h, k)
             else:
-                # direct macro like "host" → h.host()
-                fn = getattr(h, zpath, None)
-                if callable(fn):
-                    row[itop_attr] = fn()
-                else:
-                    row[itop_attr] = ""
+                # direct macro like "hostname" → h.hostname()
+                fn = handler
+
+        else:
+            continue
 
-    return row
+        plan.append((spec["itop"], fn))
 
+    return plan
+
+
+def build_rows_for_hosts(hosts: List[ZabbixHost], plan) -> List[Tuple[str, ...]]:
+    """
+    Build output rows for batch of hosts from compiled column plan.
+    Values are computed column by column (one list per itop column)
+    and zipped into rows in column order.
+    """
+    cols = [list(map(fn, hosts)) for _, fn in plan]
+    return list(zip(*cols))
 
-def write_csv(outfile: str, rows: List[Dict[str, str]], columns) -> None:
-    if not rows:
-        # still create an empty CSV with just headers? We'll skip to be explicit.
-        print("No rows to write; skipping CSV.")
-        return
-    with open(outfile, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=columns)
-        writer.writeheader()
-        writer.writerows(rows)
-    print(f"✅ Wrote {len(rows)} rows to {outfile}")
+
+# write buffer for output CSV files, amortizes many small row writes
+CSV_BUFFER_SIZE = 1 << 20
 
 
 def chunks(seq, size):
@@ -101,6 +121,272 @@ def chunks(seq, size):
         yield seq[i:i + size]
 
 
+# host.get selectors used when every host field may be needed
+FULL_SELECTORS: Dict[str, Any] = {
+    "output": "extend",
+    "selectInventory": "extend",
+    "selectHostGroups": "extend",
+    "selectTags": "extend",
+    "selectParentTemplates": [
+        "templateid",
+        "name"
+    ],
+    "selectInterfaces": "extend",
+    "selectInheritedTags": "extend"
+}
+
+
+# host inventory and interface fields accepted by host.get select lists
+INVENTORY_FIELDS = frozenset([
+    "type", "type_full", "name", "alias", "os", "os_full", "os_short",
+    "serialno_a", "serialno_b", "tag", "asset_tag", "macaddress_a", "macaddress_b",
+    "hardware", "hardware_full", "software", "software_full",
+    "software_app_a", "software_app_b", "software_app_c", "software_app_d", "software_app_e",
+    "contact", "location", "location_lat", "location_lon", "notes",
+    "chassis", "model", "hw_arch", "vendor", "contract_number", "installer_name",
+    "deployment_status", "url_a", "url_b", "url_c",
+    "host_networks", "host_netmask", "host_router", "oob_ip", "oob_netmask", "oob_router",
+    "date_hw_purchase", "date_hw_install", "date_hw_expiry", "date_hw_decomm",
+    "site_address_a", "site_address_b", "site_address_c", "site_city", "site_state",
+    "site_country", "site_zip", "site_rack", "site_notes",
+    "poc_1_name", "poc_1_email", "poc_1_phone_a", "poc_1_phone_b", "poc_1_cell",
+    "poc_1_screen", "poc_1_notes",
+    "poc_2_name", "poc_2_email", "poc_2_phone_a", "poc_2_phone_b", "poc_2_cell",
+    "poc_2_screen", "poc_2_notes"
+])
+INTERFACE_FIELDS = frozenset([
+    "interfaceid", "hostid", "type", "main", "useip", "ip", "dns", "port",
+    "available", "error", "errors_from", "disable_until", "details"
+])
+
+
+def _checked_fields(kind: str, keys: Set[str], known: FrozenSet[str]) -> Any:
+    """Return sorted select list, or "extend" if config uses unknown fields."""
+    unknown = keys - known
+    if unknown:
+        logging.error("Unknown %s field(s) %s in map columns, fetching all %s fields" % (kind, ", ".join(sorted(unknown)), kind))
+        return "extend"
+    return sorted(keys)
+
+
+def get_host_selectors(cfg) -> Dict[str, Any]:
+    """
+    Compute minimal host.get selectors from map columns and filters of output.
+    Template columns can reference any host data, so like "select: extend"
+    in output config they fetch everything.
+    """
+    if cfg.get("select") == "extend":
+        return dict(FULL_SELECTORS)
+
+    output = {"hostid", "host"}
+    inventory = set()
+    interfaces = set()
+    needs_tags = bool(cfg.get("excluded_tags"))
+    needs_groups = bool(cfg.get("excluded_groups"))
+    for entry in cfg["columns"]:
+        if "template" in entry:
+            return dict(FULL_SELECTORS)
+        if "map" not in entry:
+            continue
+        prefix, _, key = entry["map"]["zabbix"].partition(".")
+        if prefix == "hostname":
+            output.add("host")
+        elif prefix == "visiblename":
+            output.add("name")
+        elif prefix == "tag":
+            needs_tags = True
+        elif prefix == "groups":
+            needs_groups = True
+        elif prefix == "inventory":
+            inventory.add(key)
+        elif prefix == "interface":
+            # domain and host are derived from dns
+            interfaces.add("dns" if key in ("domain", "host") else key)
+
+    selectors: Dict[str, Any] = {"output": sorted(output)}
+    if inventory:
+        selectors["selectInventory"] = _checked_fields("inventory", inventory, INVENTORY_FIELDS)
+    if interfaces:
+        selectors["selectInterfaces"] = _checked_fields("interface", interfaces, INTERFACE_FIELDS)
+    if needs_tags:
+        selectors["selectTags"] = ["tag", "value"]
+    if needs_groups:
+        selectors["selectHostGroups"] = ["name"]
+    return selectors
+
+
+def fetch_batch(rpc: ZabbixRPC, batch: List[Dict[str, Any]], selectors: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Fetch host details for one batch of host ids."""
+    return rpc.call("host.get", dict(
+        hostids=[h["hostid"] for h in batch],
+        **selectors
+    ))
+
+
+def fetch_batches(rpc: ZabbixRPC, batches: Iterable[List[Dict[str, Any]]], selectors: Dict[str, Any], parallel: int) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Fetch host details for batches concurrently and yield them in input order.
+    At most 2 * parallel batches are in flight or waiting for the consumer,
+    so fetching never runs far ahead of writing.
+    """
+    window: Deque[Future] = deque()
+    with ThreadPoolExecutor(max_workers=parallel) as ex:
+        try:
+            for batch in batches:
+                if len(window) >= 2 * parallel:
+                    yield window.popleft().result()
+                window.append(ex.submit(fetch_batch, rpc, batch, selectors))
+            while window:
+                yield window.popleft().result()
+        finally:
+            for fut in window:
+                fut.cancel()
+
+
+# group/template lookups shared by outputs with the same name sets
+_metadata_cache: Dict[Tuple[str, FrozenSet[str]], List[Dict[str, Any]]] = {}
+
+
+def get_output_hostids(rpc: ZabbixRPC, ocfg) -> List[Dict[str, Any]]:
+    """Fetch ids of hosts matching required filters of output."""
+    zargs: Dict[str, Any] = {
+        "output": ["hostid"]
+    }
+    # Resolve required groups, templates and hosts of excluded groups
+    # in one batch request, reusing lookups done for previous outputs
+    metadata: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+    if ocfg.get("required_groups"):
+        metadata["groupids"] = ("hostgroup.get", {
+            "output": ["groupid"],
+            "search": {"name": ocfg.get("required_groups")},
+            "searchWildcardsEnabled": True
+        })
+    if ocfg.get("required_templates"):
+        metadata["templateids"] = ("template.get", {
+            "output": ["templateid"],
+            "filter": {"name": ocfg.get("required_templates")}
+        })
+    if ocfg.get("excluded_groups"):
+        metadata["excluded"] = ("hostgroup.get", {
+            "output": ["groupid"],
+            "filter": {"name": ocfg.get("excluded_groups")},
+            "selectHosts": ["hostid"]
+        })
+    keys = {
+        "groupids": ("groupids", frozenset(ocfg.get("required_groups") or [])),
+        "templateids": ("templateids", frozenset(ocfg.get("required_templates") or [])),
+        "excluded": ("excluded", frozenset(ocfg.get("excluded_groups") or []))
+    }
+    missing = [k for k in metadata if keys[k] not in _metadata_cache]
+    if missing:
+        for (k, result) in zip(missing, rpc.batch([metadata[k] for k in missing])):
+            _metadata_cache[keys[k]] = result
+    results: Dict[str, Any] = {k: _metadata_cache[keys[k]] for k in metadata}
+    if "groupids" in results:
+        zargs["groupids"] = [g["groupid"] for g in results["groupids"]]
+    if "templateids" in results:
+        zargs["templateids"] = [t["templateid"] for t in results["templateids"]]
+
+    if ocfg.get("required_tags"):
+        zargs["tags"] = []
+        for tag in ocfg.get("required_tags"):
+            (name, value) = tag.split("=")
+            zargs["tags"].append({
+                "tag": name,
+                "value": value,
+                "operator": 0
+            })
+
+    hostids: List[Dict[str, Any]] = rpc.call("host.get", zargs)
+    if "excluded" in results:
+        # Zabbix cannot exclude groups in host.get, so drop their hosts
+        # here before fetching any details
+        excluded = {h["hostid"] for g in results["excluded"] for h in g.get("hosts", [])}
+        hostids = [h for h in hostids if h["hostid"] not in excluded]
+    return hostids
+
+
+def export_output(rpc: ZabbixRPC, ocfg) -> int:
+    """Export hosts of one output to its outfile and return number of rows written."""
+    columns = get_output_columns(ocfg)
+    plan = compile_columns(ocfg)
+    unique = [columns.index(u) for u in ocfg.get("unique") or []]
+    selectors = get_host_selectors(ocfg)
+    filters = compile_filters(ocfg)
+    hostids = get_output_hostids(rpc, ocfg)
+
+    # Filter + build rows, streaming them to a temporary file so
+    # an interrupted run never leaves a partial outfile behind
+    outfile = ocfg.get("outfile")
+    tmpfile = outfile + ".tmp"
+    written = 0
+    uniqueset: Set[Tuple[str, ...]] = set()
+    bs = ocfg.get("batch_size", 100)
+    total = (len(hostids) + bs - 1) // bs
+    try:
+        # closing() stops pending fetches right away if writing fails
+        with open(tmpfile, "w", newline="", encoding="utf-8", buffering=CSV_BUFFER_SIZE) as f, \
+                contextlib.closing(fetch_batches(rpc, chunks(hostids, bs), selectors, ocfg.get("parallel", 4))) as zbatches:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for zbatch in tqdm.tqdm(zbatches, total=total, unit="host", unit_scale=bs):
+                hosts = []
+                for h in zbatch:
+                    zh = ZabbixHost(h, ocfg, filters)
+                    if not zh._matches():
+                        logging.info("Skipping host %s (did not pass filters)" % h)
+                        continue
+                    hosts.append(zh)
+                rows = build_rows_for_hosts(hosts, plan)
+                if unique:
+                    fresh = []
+                    for row in rows:
+                        rowid = tuple(row[i] for i in unique)
+                        if rowid in uniqueset:
+                            logging.debug("Rowid %s already reported as unique. Skipping" % (rowid,))
+                            continue
+                        uniqueset.add(rowid)
+                        fresh.append(row)
+                    rows = fresh
+                writer.writerows(rows)
+                written += len(rows)
+    except BaseException:
+        # do not leave partial temporary file behind on errors or interrupt
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+        raise
+
+    if written > 0:
+        os.replace(tmpfile, outfile)
+        print(f"✅ Wrote {written} rows to {outfile}")
+    else:
+        os.remove(tmpfile)
+        logging.warning("Zero rows for %s" % outfile)
+    return written
+
+
+_CMD_ENV = jinja2.Environment(
+    loader=jinja2.BaseLoader(),
+    autoescape=False,
+    trim_blocks=True,
+    lstrip_blocks=True,
+)
+
+
+@functools.lru_cache(maxsize=32)
+def _cmd_tmpl(src: str) -> jinja2.Template:
+    """compile import command template once per distinct command"""
+    return _CMD_ENV.from_string(src)
+
+
+def wait_import(proc) -> None:
+    """Wait for running import command and report its failure."""
+    if proc is None:
+        return
+    if proc.wait() != 0:
+        logging.warning("Import command %s failed with exit code %s" % (proc.args, proc.returncode))
+
+
 # -------------------------
 # Main
 # -------------------------
@@ -115,7 +401,7 @@ def main() -> None:
     gargs = parser.parse_args()
 
     with open(gargs.config, encoding="utf-8") as f:
-        cfg = yaml.safe_load(f)
+        cfg = yaml.load(f, Loader=SafeLoader)
 
     if gargs.debug:
         logging.getLogger().setLevel(logging.DEBUG)
@@ -126,109 +412,34 @@ def main() -> None:
 
     args = cfg.get("options")
 
-    for output in tqdm.tqdm(cfg.get("outputs").keys()):
-
-        ocfg = cfg.get("outputs")[output]
-        if gargs.skip_existing and os.path.exists(ocfg.get("outfile")):
-            logging.warning("Skipping output %s (file already exists)" % output)
-            continue
-
-        logging.warning("Processing output %s" % output)
-        columns = get_output_columns(ocfg)
-
-        # Connect to Zabbix
-        zapi = ZabbixAPI(args.get("url"))
-        zapi.login(user=args.get("user"), password=args.get("password"))
-
-        # Fetch hosts with all the extended info we need
-        zargs = {
-            output: ["hostid"]
-        }
-        if ocfg.get("required_groups"):
-            zargs["groupids"] = []
-            for g in zapi.hostgroup.get(
-                output=["groupid"],
-                search={"name": ocfg.get("required_groups")},
-                searchWildcardsEnabled=True
-              ):
-                zargs["groupids"].append(g["groupid"])
-
-        if ocfg.get("required_templates"):
-            zargs["templateids"] = []
-            for t in zapi.hostgroup.get(
-                output=["templateid"],
-                filter={"name": ocfg.get("required_templates")}
-            ):
-                zargs["templateids"].append(t["templateid"])
-
-        if ocfg.get("required_tags"):
-            zargs["tags"] = []
-            for tag in ocfg.get("required_tags"):
-                (name, value) = tag.split("=")
-                zargs["tags"].append({
-                    "tag": name,
-                    "value": value,
-                    "operator": 0
-                })
-
-        hostids: List[Dict[str, Any]] = zapi.host.get(**zargs)
-
-        # Filter + build rows
-        rows: List[Dict[str, str]] = []
-        uniqueset = []
-        for batch in tqdm.tqdm(list(chunks(hostids, ocfg.get("batch_size", 100))), unit="host", unit_scale=ocfg.get("batch_size", 100)):
-            hostids = []
-            for h in batch:
-                hostids.append(h["hostid"])
-            zbatch = zapi.host.get(
-                hostids=hostids,
-                selectInventory="extend",
-                selectHostGroups="extend",
-                selectTags="extend",
-                selectParentTemplates=[
-                    "templateid",
-                    "name"
-                ],
-                selectInterfaces="extend",
-                selectInheritedTags="extend"
-            )
-
-            for h in zbatch:
-                zh = ZabbixHost(h, ocfg)
-                if not zh._matches():
-                    logging.info("Skipping host %s (did not pass filters)" % h)
-                    continue
-                row = build_row_for_host(zh, ocfg)
-                # Optional: warn if unique path was provided but not present/mapped (soft check)
-                if ocfg.get("unique"):
-                    # try to see if at least one column maps the unique path
-                    # (not enforced; only a heads-up for the operator)
-                    rowid = []
-                    for u in ocfg.get("unique"):
-                        rowid.append(row[u])
-                    if rowid in uniqueset:
-                        logging.debug("Rowid %s already reported as unique. Skipping" % rowid)
-                    else:
-                        uniqueset.append(rowid)
-                        rows.append(row)
-                else:
-                    rows.append(row)
-        if len(rows) > 0:
-            write_csv(ocfg.get("outfile"), rows, columns)
-            cmd = ocfg.get("import_cmd", "")
-            if cmd:
-                env = jinja2.Environment(
-                    loader=jinja2.BaseLoader(),
-                    autoescape=False,
-                    trim_blocks=True,
-                    lstrip_blocks=True,
-                )
-                tmpl = env.from_string(cmd)
-                cmd = tmpl.render(outfile=ocfg.get("outfile"))
-                os.system(cmd)
-
-        else:
-            logging.warning("Zero rows for %s" % ocfg.get("outfile"))
+    # Connect to Zabbix once, all outputs share the session
+    zapi = ZabbixAPI(args.get("url"))
+    zapi.login(user=args.get("user"), password=args.get("password"))
+    rpc = ZabbixRPC(zapi, pool_size=max(
+        [16] + [o.get("parallel", 4) for o in cfg.get("outputs").values()]
+    ))
+
+    import_proc = None
+    try:
+        for output in tqdm.tqdm(cfg.get("outputs").keys()):
+
+            ocfg = cfg.get("outputs")[output]
+            if gargs.skip_existing and os.path.exists(ocfg.get("outfile")):
+                logging.warning("Skipping output %s (file already exists)" % output)
+                continue
+
+            logging.warning("Processing output %s" % output)
+            if export_output(rpc, ocfg) > 0:
+                cmd = ocfg.get("import_cmd", "")
+                if cmd:
+                    cmd = _cmd_tmpl(cmd).render(outfile=ocfg.get("outfile"))
+                    # Run import in background while next output is exported,
+                    # but keep imports ordered as later ones may depend on earlier
+                    wait_import(import_proc)
+                    import_proc = subprocess.Popen(cmd, shell=True)
+    finally:
+        # never leave running import behind, even if an export failed
+        wait_import(import_proc)
 
 
 if __name__ == "__main__":
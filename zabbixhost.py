@@ -1,10 +1,56 @@
+import functools
+import logging
+from typing import FrozenSet, Optional, Tuple
+
 import jinja2
 
+_JINJA_ENV = jinja2.Environment(
+    loader=jinja2.BaseLoader(),
+    autoescape=False,
+    trim_blocks=True,
+    lstrip_blocks=True,
+    undefined=jinja2.StrictUndefined
+)
+
+
+@functools.lru_cache(maxsize=256)
+def compile_template(src: str) -> jinja2.Template:
+    """compile template source once and reuse it for every host"""
+    return _JINJA_ENV.from_string(src)
+
+
+def compile_filters(cfg: dict) -> Tuple[FrozenSet[Tuple[str, ...]], FrozenSet[str]]:
+    """parse excluded filters of output cfg into (tag pairs, group names)"""
+    tags = frozenset(tuple(et.split("=", 1)) for et in cfg.get("excluded_tags") or [])
+    groups = frozenset(cfg.get("excluded_groups") or [])
+    return (tags, groups)
+
 
 class ZabbixHost:
-    def __init__(self, host: dict, cfg: dict):
+    def __init__(self, host: dict, cfg: dict, filters: Optional[tuple] = None):
         self._host = host
-        self._cfg = cfg
+        if filters is None:
+            filters = compile_filters(cfg)
+        self._filters = filters
+        self._tag_map = {}
+        self._tag_pairs = set()
+        for t in host.get("tags", []):
+            self._tag_map.setdefault(t.get("tag"), t.get("value", ""))
+            self._tag_pairs.add((t.get("tag"), t.get("value", "")))
+        self._group_set = {g["name"] for g in host.get("hostgroups", [])}
+        self._interface_by_key = {}
+        for intf in host.get("interfaces", []):
+            for k, v in intf.items():
+                if v:
+                    self._interface_by_key.setdefault(k, v)
+        # split dns once into short host name and domain
+        (self._dns_host, self._dns_domain) = ("", "")
+        dns = self._interface_by_key.get("dns", "")
+        if "." in dns:
+            (self._dns_host, rest) = dns.split(".", 1)
+            if rest and not rest.endswith("."):
+                rest += "."
+            self._dns_domain = rest
 
     def hostname(self) -> str:
         """technical host name"""
@@ -16,10 +62,7 @@ class ZabbixHost:
 
     def tag(self, tname: str) -> str:
         """get tag value by name"""
-        for t in self._host.get("tags", []):
-            if t.get("tag") == tname:
-                return t.get("value","")
-        return ""
+        return self._tag_map.get(tname, "")
 
     def inventory(self, key: str) -> str:
         """get inventory field"""
@@ -40,55 +83,19 @@ class ZabbixHost:
     def interface(self, key: str) -> str:
         """get IP from interface"""
         if key == "domain":
-            dns = self.interface("dns")
-            try:
-                (host, rest) = dns.split(".", 1)
-                if rest and not rest.endswith("."):
-                    rest += "."
-                return rest
-            except Exception:
-                return ""
+            return self._dns_domain
         elif key == "host":
-            dns = self.interface("dns")
-            try:
-                (host, rest) = dns.split(".", 1)
-                return host
-            except Exception:
-                return ""
+            return self._dns_host
         else:
-            for intf in self._host.get("interfaces", []):
-                if intf.get(key):
-                    return intf.get(key)
-        return ""
+            return self._interface_by_key.get(key, "")
 
     def _matches(self) -> bool:
         """check host matches required filters from cfg."""
-        if self._cfg.get("excluded_tags", []):
-            for et in self._cfg.get("excluded_tags", ""):
-                for t in self._host["tags"]:
-                    (name, value) = et.split("=")
-                    if t["tag"] == name and t["value"] == value:
-                        return False
-        if self._cfg.get("excluded_groups", ""):
-            for eg in self._cfg.get("excluded_groups", ""):
-                for g in self._host["hostgroups"]:
-                    if g["name"] == eg:
-                        return False
-        return True
-
-    def _expand_macros(self, tmpl: str) -> str:
-        env = jinja2.Environment(
-            loader=jinja2.BaseLoader(),
-            autoescape=False,
-            trim_blocks=True,
-            lstrip_blocks=True,
-            undefined=jinja2.StrictUndefined
-        )
-        tpl = env.from_string(tmpl)
-        expanded = tpl.render(zbx=self)
-        return expanded
+        (tags, groups) = self._filters
+        return tags.isdisjoint(self._tag_pairs) and groups.isdisjoint(self._group_set)
 
     @classmethod
+    @functools.lru_cache(maxsize=None)
     def doc(cls) -> str:
         """list supported macros"""
         lines = ["Available items for zabbix host:"]
@@ -102,11 +109,12 @@ class ZabbixHost:
         return "\n".join(lines)
 
     def __getattr__(self, item):
-        if item in self._host:
-            return self._host[item]
-        else:
-            print(self.doc())
-            raise Exception("Item zbx.%s not found!" % item)
+        host = self.__dict__.get("_host", {})
+        if item in host:
+            return host[item]
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(self.doc())
+        raise AttributeError("Item zbx.%s not found!" % item)
 
     def __repr__(self):
         return self.hostname()
@@ -0,0 +1,89 @@
+import itertools
+import json
+from typing import Any, Dict, List, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import orjson  # type: ignore
+except ImportError:
+    orjson = None
+
+
+def _loads(data: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class ZabbixRPC:
+    """
+    Minimal JSON-RPC client sharing session of logged in ZabbixAPI.
+    It can send several API calls as one JSON-RPC batch request.
+    """
+
+    def __init__(self, zapi, pool_size: int = 16):
+        self._url = zapi.url
+        # zabbix_utils keeps the session id private
+        token = getattr(zapi, "_ZabbixAPI__session_id", None)
+        if not token:
+            raise Exception(
+                "Cannot read Zabbix API session from zabbix_utils ZabbixAPI; "
+                "not logged in or unsupported zabbix-utils version!"
+            )
+        self._headers = {"Content-Type": "application/json-rpc"}
+        self._auth = None
+        if zapi.version < 6.4:
+            self._auth = token
+        else:
+            self._headers["Authorization"] = "Bearer %s" % token
+        self._timeout = getattr(zapi, "timeout", 30)
+        self._ids = itertools.count(1)
+        self._session = requests.Session()
+        self._session.verify = getattr(zapi, "validate_certs", True)
+        # keep-alive connections for concurrent batch fetches
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    def batch(self, calls: List[Tuple[str, Dict[str, Any]]]) -> List[Any]:
+        """send (method, params) calls in one request and return their results in order"""
+        reqs = []
+        for (method, params) in calls:
+            req = {
+                "jsonrpc": "2.0",
+                "method": method,
+                "params": params,
+                "id": next(self._ids)
+            }
+            if self._auth:
+                req["auth"] = self._auth
+            reqs.append(req)
+
+        resp = self._session.post(
+            self._url,
+            data=json.dumps(reqs),
+            headers=self._headers,
+            timeout=self._timeout
+        )
+        resp.raise_for_status()
+        data = _loads(resp.content)
+        if isinstance(data, dict):
+            # whole batch was rejected
+            raise Exception("Zabbix API batch failed: %s" % data.get("error"))
+        replies = {r.get("id"): r for r in data}
+
+        results = []
+        for req in reqs:
+            reply = replies.get(req["id"])
+            if reply is None:
+                raise Exception("No reply for Zabbix API call %s!" % req["method"])
+            if "error" in reply:
+                raise Exception("Zabbix API call %s failed: %s" % (req["method"], reply["error"]))
+            results.append(reply["result"])
+        return results
+
+    def call(self, method: str, params: Dict[str, Any]) -> Any:
+        """send single API call"""
+        return self.batch([(method, params)])[0]